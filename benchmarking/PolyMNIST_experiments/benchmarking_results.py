@@ -86,23 +86,23 @@ for k in range(5):
             df = pd.DataFrame.from_dict(subset_dict, orient='index')
             #create a column for accuracy
             df['accuracy'] = 0
+            labels = torch.tensor(test_labels).to(DEVICE)
             for subset in subset_dict:
                 in_modalities = subset_dict[subset]['input_modalities']
                 out_modalities = subset_dict[subset]['output_modalities']
-                recon = model.predict_reconstruction(test_files, input_modalities=in_modalities, output_modalities=out_modalities, batch_size=256)[0]
+                recon = model.predict_reconstruction(test_files, input_modalities=in_modalities, output_modalities=out_modalities, batch_size=256, to_numpy=False)[0]
                 #get prediction accuracy for each modality and average
                 acc = 0
                 accs_per_class = {m: MulticlassAccuracy(10, average=None).to(DEVICE) for m in out_modalities}
                 for i, mod in enumerate(out_modalities):
-                    #convert to tensor
-                    recon_mod = torch.tensor(recon[i])
-                    recon_mod = recon_mod.to(DEVICE)
+                    #reconstructions are kept on the model device
+                    recon_mod = recon[i].to(DEVICE)
                     #pass through pretrained classifier
                     clf = clfs[f'm{mod}']
                     clf.eval()
                     with torch.no_grad():
                         pred = clf(recon_mod)
-                        acc = accs_per_class[mod](pred, torch.tensor(test_labels).to(DEVICE))
+                        acc = accs_per_class[mod](pred, labels)
 
                 acc_per_class = {
                         f"{subset}_to_{m}": accs_per_class[m].compute().cpu()
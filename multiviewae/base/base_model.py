@@ -2,6 +2,7 @@ import os
 import numpy as np
 import hydra
 import re
+import inspect
 import collections.abc
 import omegaconf 
 
@@ -21,6 +22,7 @@ from .constants import *
 from .validation import config_schema
 from .exceptions import *
 from .validation import SUPPORTED_DATASETS
+from .dataloaders import CUDAPrefetcher, dataloader_kwargs, default_num_workers
 from ..architectures.mlp import ConditionalVariationalEncoder, ConditionalVariationalDecoder
 
 def update_dict(d, u, l):
@@ -132,6 +134,7 @@ class BaseModelAE(ABC, pl.LightningModule):
             raise InputError("no labels given for Conditional VAE")
 
         self._training = True
+        self._init_rng()
         if max_epochs is not None:
             self.max_epochs = max_epochs
             self.cfg.trainer.max_epochs = max_epochs
@@ -149,23 +152,32 @@ class BaseModelAE(ABC, pl.LightningModule):
             for _, cb_conf in self.cfg.callbacks.items():
                 callbacks.append(hydra.utils.instantiate(cb_conf))
 
+        # set both flags on every run, cuDNN allows TF32 by default and an earlier fit may have changed them
+        if torch.cuda.is_available():
+            torch.backends.cuda.matmul.allow_tf32 = self.use_tf32
+            torch.backends.cudnn.allow_tf32 = self.use_tf32
+
         logger = hydra.utils.instantiate(self.cfg.logger)
 
         py_trainer = hydra.utils.instantiate(
             self.cfg.trainer, callbacks=callbacks, logger=logger,
         )
+        # only datamodules that take a seed (e.g. the built-in ones) get one for the train/validation split
+        datamodule_kwargs = {}
+        if "seed" in inspect.signature(hydra.utils.get_class(self.cfg.datamodule._target_)).parameters:
+            datamodule_kwargs["seed"] = self.cfg.model.seed if self.cfg.model.seed_everything else None
         datamodule = hydra.utils.instantiate(
-           self.cfg.datamodule, data=data, n_views=self.n_views, labels=labels, _convert_="all", _recursive_=False
+           self.cfg.datamodule, data=data, n_views=self.n_views, labels=labels, **datamodule_kwargs, _convert_="all", _recursive_=False
         )
 
         py_trainer.fit(self, datamodule)
         
 
-    def predict_latents(self, *data, input_modalities=None, labels=None, batch_size=None):
-        return self.__predict(*data, input_modalities=input_modalities, labels=labels, batch_size=batch_size)
+    def predict_latents(self, *data, input_modalities=None, labels=None, batch_size=None, to_numpy=True):
+        return self.__predict(*data, input_modalities=input_modalities, labels=labels, batch_size=batch_size, to_numpy=to_numpy)
 
-    def predict_reconstruction(self, *data, input_modalities=None, output_modalities=None, labels=None, batch_size=None):
-        return self.__predict(*data, input_modalities=input_modalities, output_modalities=output_modalities, labels=labels, batch_size=batch_size, is_recon=True)
+    def predict_reconstruction(self, *data, input_modalities=None, output_modalities=None, labels=None, batch_size=None, to_numpy=True):
+        return self.__predict(*data, input_modalities=input_modalities, output_modalities=output_modalities, labels=labels, batch_size=batch_size, is_recon=True, to_numpy=to_numpy)
 
     def print_config(self, cfg=None, keys=None):
         if cfg is None:
@@ -267,6 +279,119 @@ class BaseModelAE(ABC, pl.LightningModule):
 
             self.prior = hydra.utils.instantiate(self.cfg.prior)
 
+    def _init_rng(self):
+        # local numpy RNG for random choices in the models (e.g. the encoder used for a missing view), so the
+        # global numpy RNG is left untouched. reseeded on every fit so consecutive fits make the same draws
+        seed = self.cfg.model.seed if self.cfg.model.get("seed_everything", False) and "seed" in self.cfg.model else None
+        self._rng = np.random.default_rng(seed)
+
+    def _compile_networks(self, encoders=True, decoders=True):
+        if not hasattr(torch.nn.Module, "compile"):
+            raise ConfigError("model.use_compile requires torch>=2.2")
+        # compile in place so the module classes and state_dict keys are unchanged
+        networks = ([*self.encoders] if encoders else []) + ([*self.decoders] if decoders else [])
+        for net in networks:
+            net.compile(mode="reduce-overhead")
+
+    def _is_homogeneous(self, networks, net_cfgs):
+        """Whether the per-view networks share the same class, configuration and input dimensionality,
+        so their forward passes can be vectorised with _batched_forward."""
+        if len(networks) < 2 or not hasattr(torch, "func"):
+            return False
+        if any(isinstance(net, (ConditionalVariationalEncoder, ConditionalVariationalDecoder)) for net in networks):
+            return False
+        # buffer updates (e.g. batch norm running statistics) would be lost in the stacked copies,
+        # and vmap does not allow random operations such as dropout
+        if any(len(list(net.buffers())) > 0 or
+               any(isinstance(m, torch.nn.modules.dropout._DropoutNd) for m in net.modules())
+               for net in networks):
+            return False
+        return all(type(net) is type(networks[0]) for net in networks) and \
+            all(net_cfg == net_cfgs[0] for net_cfg in net_cfgs) and \
+            all(d == self.input_dim[0] for d in self.input_dim)
+
+    def _batched_forward(self, networks, x):
+        """Run a forward pass of identically shaped networks on their inputs in a single vectorised call.
+        The network parameters are stacked along a leading view dimension, so gradients still flow to each network.
+
+        Args:
+            networks (list): list of networks with identical architectures.
+            x (list): list of inputs of type torch.Tensor, one per network.
+
+        Returns:
+            Network outputs stacked along the leading view dimension.
+        """
+        named_params = [dict(net.named_parameters()) for net in networks]
+        named_buffers = [dict(net.named_buffers()) for net in networks]
+        params = {k: torch.stack([p[k] for p in named_params]) for k in named_params[0]}
+        buffers = {k: torch.stack([b[k] for b in named_buffers]) for k in named_buffers[0]}
+
+        def call(params_, buffers_, x_):
+            return torch.func.functional_call(networks[0], (params_, buffers_), (x_,))
+
+        return torch.func.vmap(call)(params, buffers, torch.stack(x))
+
+    def _predict_dataloader(self, data, labels, batch_size):
+        dataset = hydra.utils.instantiate(self.cfg.datamodule.dataset, data=data, labels=labels, n_views=self.n_views)
+        # slicing in-memory views is cheap, so prediction loads batches in the main process unless
+        # datamodule.num_workers is set. pinning only helps copies to the GPU
+        num_workers = self.cfg.datamodule.get("num_workers", 0)
+        if num_workers is None:
+            num_workers = default_num_workers()
+        pin_memory = self.cfg.datamodule.get("pin_memory", True) and self.device.type == "cuda"
+        # the loader is built per call, workers are not kept alive after the prediction
+        loader = DataLoader(dataset, **dataloader_kwargs(dataset, batch_size, num_workers, pin_memory, persistent_workers=False))
+        if self.device.type == "cuda":
+            loader = CUDAPrefetcher(loader, device=self.device)
+        return loader
+
+    def _prepare_predict(self, data, labels, batch_size):
+        # shared by all prediction methods: checks the inputs, switches the model to prediction mode
+        # and returns a prediction loader built for this call
+        if any([isinstance(enc, ConditionalVariationalEncoder) for enc in self.encoders]) and labels is None: 
+            raise InputError("no labels given for Conditional VAE")
+
+        if any([isinstance(dec, ConditionalVariationalDecoder) for dec in self.decoders]) and labels is None: 
+            raise InputError("no labels given for Conditional VAE")
+        
+        self._training = False
+        for i in range(len(self.encoders)):
+            self.encoders[i].training = False
+        for i in range(len(self.decoders)):
+            self.decoders[i].training = False
+
+        data = list(data)
+        if not self.is_index_ds:
+            if not (len(data) == self.n_views):
+                raise InputError("number of modalities must be equal to number of views")
+
+            for i in range(self.n_views):
+                data_dim = data[i].shape[1:]
+                if len(data_dim) == 1:
+                    data_dim = data_dim[0]
+                if not (data_dim == self.input_dim[i]):
+                    raise InputError("modality's shape must be equal to corresponding input_dim's shape")
+
+        if batch_size is None:
+            if self.is_index_ds:
+                batch_size = len(data[0])
+            else:
+                batch_size = data[0].shape[0]
+
+        return self._predict_dataloader(data, labels, batch_size)
+
+    def _predict_batches(self, generator):
+        # yields the input views of each prediction batch on the model device, with the batch labels set
+        for local_batch in generator:
+            local_batchx, local_batchy, _ = self._unpack_batch(local_batch)
+            if local_batchy is not None:
+                local_batchy = local_batchy.to(self.device, non_blocking=True)
+            self._set_batch_labels(local_batchy)
+
+            yield [
+                local_batchx_.to(self.device, non_blocking=True) for local_batchx_ in local_batchx
+            ]
+
     def _unpack_batch(self, batch): # dataset returned other vars than x, need to unpack
         if isinstance(batch[0], list): 
             batch_x, batch_y, *other = batch
@@ -307,17 +432,24 @@ class BaseModelAE(ABC, pl.LightningModule):
             print("MODEL: ", self.model_name)
             self.print_config() #TODO: put this in debug mode logging
 
-        if all(k in self.cfg.model for k in ["seed_everything", "seed"]):
+        if self.cfg.model.get("seed_everything", False) and "seed" in self.cfg.model:
             pl.seed_everything(self.cfg.model.seed, workers=True)
+        self._init_rng()
 
-        if not at_fit or ("encoder" in new_cfg.keys()):
+        set_encoders = not at_fit or ("encoder" in new_cfg.keys())
+        set_decoders = not at_fit or ("decoder" in new_cfg.keys())
+        if set_encoders:
             self._setencoders()
 
-        if not at_fit or ("decoder" in new_cfg.keys()):
+        if set_decoders:
             self._setdecoders()
 
         if not at_fit or ("prior" in new_cfg.keys()):
             self._setprior()
+
+        # only compile the networks just rebuilt, the others were compiled when they were set
+        if self.use_compile and (set_encoders or set_decoders):
+            self._compile_networks(encoders=set_encoders, decoders=set_decoders)
         
         if at_fit:
             self.create_folder(self.cfg.out_dir)
@@ -448,55 +580,23 @@ class BaseModelAE(ABC, pl.LightningModule):
                 
         fwd_return = self.forward(batch_x)
         loss = self.loss_function(batch_x, fwd_return)
+        # losses are only accumulated on the device during the epoch, per-step logging would sync with the GPU every batch
         for loss_n, loss_val in loss.items():
             self.log(
-                f"{stage}_{loss_n}", loss_val, on_epoch=True, prog_bar=True, logger=True
+                f"{stage}_{loss_n}", loss_val, on_step=False, on_epoch=True, prog_bar=True, logger=True
             )
         return loss["loss"]
 
-    def __predict(self, *data, input_modalities=None, output_modalities=None, labels=None, batch_size=None, is_recon=False):
-        if any([isinstance(enc, ConditionalVariationalEncoder) for enc in self.encoders]) and labels is None: 
-            raise InputError("no labels given for Conditional VAE")
+    def __predict(self, *data, input_modalities=None, output_modalities=None, labels=None, batch_size=None, is_recon=False, to_numpy=True):
+        generator = self._prepare_predict(data, labels, batch_size)
 
-        if any([isinstance(dec, ConditionalVariationalDecoder) for dec in self.decoders]) and labels is None: 
-            raise InputError("no labels given for Conditional VAE")
-        
-        self._training = False
-        for i in range(len(self.encoders)):
-            self.encoders[i].training = False
-        for i in range(len(self.decoders)):
-            self.decoders[i].training = False
-
-        data = list(data)
-        if not self.is_index_ds:
-            if not (len(data) == self.n_views):
-                raise InputError("number of modalities must be equal to number of views")
-
-            for i in range(self.n_views):
-                data_dim = data[i].shape[1:]
-                if len(data_dim) == 1:
-                    data_dim = data_dim[0]
-                if not (data_dim == self.input_dim[i]):
-                    raise InputError("modality's shape must be equal to corresponding input_dim's shape")
-
-        dataset = hydra.utils.instantiate(self.cfg.datamodule.dataset, data=data, labels=labels, n_views=self.n_views)
-        if batch_size is None:
-            if self.is_index_ds:
-                batch_size = len(data[0])
-            else:
-                batch_size = data[0].shape[0]
-
-        generator = DataLoader(dataset, batch_size=batch_size, shuffle=False)
-
-        with torch.no_grad():
+        n = len(data[0])
+        # tensors created under inference_mode cannot be modified in place outside of it, so
+        # use no_grad when the outputs are returned to the caller as tensors
+        with torch.inference_mode() if to_numpy else torch.no_grad():
             z_ = None
-            for batch_idx, local_batch in enumerate(generator):
-                local_batchx, local_batchy, _ = self._unpack_batch(local_batch)
-                self._set_batch_labels(local_batchy)
-
-                local_batchx = [
-                    local_batchx_.to(self.device) for local_batchx_ in local_batchx
-                ]
+            start = 0
+            for batch_idx, local_batchx in enumerate(self._predict_batches(generator)):
                 if input_modalities is None:
                     z = self.encode(local_batchx)
                 else:
@@ -510,69 +610,47 @@ class BaseModelAE(ABC, pl.LightningModule):
                         z = self.decode_subset(z, output_modalities)
 
                 z = [
-                        [ d__._sample().cpu().detach().numpy() for d__ in d_ ]
+                        [ d__._sample() for d__ in d_ ]
                         if isinstance(d_, (list))
                         else
-                        (d_.cpu().detach().numpy() if isinstance(d_, torch.Tensor)
-                        else d_._sample().cpu().detach().numpy())
+                        (d_ if isinstance(d_, torch.Tensor)
+                        else d_._sample())
                         for d_ in z
                     ]
 
-                if z_ is not None:
+                # the batch outputs are written into one device buffer per output, copied to the host once after the loop
+                if z_ is None:
                     z_ = [
-                            [ np.append(d_, d, axis=0) for d_, d in zip(p_,p) ]
-                            if isinstance(p_, list) else np.append(p_, p, axis=0)
-                            for p_, p in zip(z_, z)
+                            [ d.new_empty((n, *d.shape[1:])) for d in p ]
+                            if isinstance(p, list) else p.new_empty((n, *p.shape[1:]))
+                            for p in z
                          ]
-                else:
-                    z_ = z
+                end = start + len(local_batchx[0])
+                for p_, p in zip(z_, z):
+                    if isinstance(p, list):
+                        for d_, d in zip(p_, p):
+                            d_[start:end] = d
+                    else:
+                        p_[start:end] = p
+                start = end
+
+        # with to_numpy=False the outputs stay on the model device, e.g. to score them there
+        if z_ is not None and to_numpy:
+            z_ = [
+                    [ d_.cpu().numpy() for d_ in p_ ]
+                    if isinstance(p_, list) else p_.cpu().numpy()
+                    for p_ in z_
+                 ]
         return z_
 
     def predict_nll(self, *data, labels=None, batch_size=None):
         if not hasattr(self, "calc_nll"):
             raise NotImplementedError("predict_nll not implemented for this model")
-        if any([isinstance(enc, ConditionalVariationalEncoder) for enc in self.encoders]) and labels is None: 
-            raise InputError("no labels given for Conditional VAE")
+        generator = self._prepare_predict(data, labels, batch_size)
 
-        if any([isinstance(dec, ConditionalVariationalDecoder) for dec in self.decoders]) and labels is None: 
-            raise InputError("no labels given for Conditional VAE")
-        
-        self._training = False
-        for i in range(len(self.encoders)):
-            self.encoders[i].training = False
-        for i in range(len(self.decoders)):
-            self.decoders[i].training = False
-
-        data = list(data)
-        if not self.is_index_ds:
-            if not (len(data) == self.n_views):
-                raise InputError("number of modalities must be equal to number of views")
-
-            for i in range(self.n_views):
-                data_dim = data[i].shape[1:]
-                if len(data_dim) == 1:
-                    data_dim = data_dim[0]
-                if not (data_dim == self.input_dim[i]):
-                    raise InputError("modality's shape must be equal to corresponding input_dim's shape")
-
-        dataset = hydra.utils.instantiate(self.cfg.datamodule.dataset, data=data, labels=labels, n_views=self.n_views)
-        if batch_size is None:
-            if self.is_index_ds:
-                batch_size = len(data[0])
-            else:
-                batch_size = data[0].shape[0]
-
-        generator = DataLoader(dataset, batch_size=batch_size, shuffle=False)
-
-        with torch.no_grad():
+        with torch.inference_mode():
             ll = 0
-            for batch_idx, local_batch in enumerate(generator):
-                local_batchx, local_batchy, _ = self._unpack_batch(local_batch)
-                self._set_batch_labels(local_batchy)
-
-                local_batchx = [
-                    local_batchx_.to(self.device) for local_batchx_ in local_batchx
-                ]
+            for batch_idx, local_batchx in enumerate(self._predict_batches(generator)):
                 ll += self.calc_nll(local_batchx)
         return ll/(batch_idx+1)
 ################################################################################
@@ -697,6 +775,8 @@ class BaseModelAAE(BaseModelAE):
             is_wasserstein=self.is_wasserstein,
             _convert_="all"
         )
+        if self.use_compile:
+            self.discriminator.compile(mode="reduce-overhead")
 
     ################################            abstract methods
     @abstractmethod
@@ -738,7 +818,7 @@ class BaseModelAAE(BaseModelAE):
         loss = self.__optimise_batch(batch_x)
         for loss_n, loss_val in loss.items():
             self.log(
-                f"train_{loss_n}", loss_val, on_epoch=True, prog_bar=True, logger=True
+                f"train_{loss_n}", loss_val, on_step=False, on_epoch=True, prog_bar=True, logger=True
             )
         return loss["loss"]
 
@@ -749,7 +829,7 @@ class BaseModelAAE(BaseModelAE):
         loss = self.__validate_batch(batch_x)
         for loss_n, loss_val in loss.items():
             self.log(
-                f"val_{loss_n}", loss_val, on_epoch=True, prog_bar=True, logger=True
+                f"val_{loss_n}", loss_val, on_step=False, on_epoch=True, prog_bar=True, logger=True
             )
         return loss["loss"]
 
@@ -799,15 +879,15 @@ class BaseModelAAE(BaseModelAE):
         dec_opt = [opts.pop(0) for idx in range(self.n_views)]
         gen_opt = [opts.pop(0) for idx in range(self.n_views)]
         disc_opt = opts[0]
-        [optimizer.zero_grad() for optimizer in enc_opt]
-        [optimizer.zero_grad() for optimizer in dec_opt]
+        for optimizer in enc_opt + dec_opt:
+            optimizer.zero_grad(set_to_none=True)
         self.manual_backward(loss_recon)
-        [optimizer.step() for optimizer in enc_opt]
-        [optimizer.step() for optimizer in dec_opt]
+        for optimizer in enc_opt + dec_opt:
+            optimizer.step()
 
         fwd_return = self.forward_discrim(local_batch)
         loss_disc = self.discriminator_loss(fwd_return)
-        disc_opt.zero_grad()
+        disc_opt.zero_grad(set_to_none=True)
         self.manual_backward(loss_disc)
         disc_opt.step()
         if self.is_wasserstein:
@@ -815,9 +895,11 @@ class BaseModelAAE(BaseModelAE):
                 p.data.clamp_(-0.01, 0.01)
         fwd_return = self.forward_gen(local_batch)
         loss_gen = self.generator_loss(fwd_return)
-        [optimizer.zero_grad() for optimizer in gen_opt]
+        for optimizer in gen_opt:
+            optimizer.zero_grad(set_to_none=True)
         self.manual_backward(loss_gen)
-        [optimizer.step() for optimizer in gen_opt]
+        for optimizer in gen_opt:
+            optimizer.step()
         loss_total = loss_recon + loss_disc + loss_gen
         loss = {
             "loss": loss_total,
@@ -828,8 +910,7 @@ class BaseModelAAE(BaseModelAE):
         return loss
 
     def __validate_batch(self, local_batch):
-        with torch.no_grad():
-            self.eval()
+        with torch.inference_mode():
             fwd_return = self.forward_recon(local_batch)
             loss_recon = self.recon_loss(local_batch, fwd_return)
             fwd_return = self.forward_discrim(local_batch)
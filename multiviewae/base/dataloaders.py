@@ -1,8 +1,11 @@
-import random
+import os
 import numpy as np
 import pytorch_lightning as pl
 import hydra
-from torch.utils.data import DataLoader
+import torch
+from torch.utils.data import DataLoader, Subset, BatchSampler, SequentialSampler
+
+from .datasets import MVDataset
 
 class MultiviewDataModule(pl.LightningDataModule):
     """LightningDataModule for multi-view data.
@@ -12,8 +15,11 @@ class MultiviewDataModule(pl.LightningDataModule):
         batch_size (int): Batch size.
         is_validate (bool): Whether to use a validation set.
         train_size (float): Proportion of batch to use for training between 0 and 1. Remainder of batch is used for validation.
-        data (list): Input data. list of torch.Tensors.
-        labels (np.array): Dataset labels. 
+        data (list): Input data. list of np.arrays or torch.Tensors, converted once to contiguous float32 tensors.
+        labels (np.array, list): Dataset labels. Converted once to np.array.
+        num_workers (int): Number of DataLoader worker processes. Default is None, which uses min(8, cpu count) (0 when workers are not forked, e.g. on Windows and macOS).
+        pin_memory (bool): Whether to load batches into pinned memory when training on a GPU. Default is True.
+        seed (int): Seed for the train/validation split. Default is None, which uses the global torch RNG.
     """
     def __init__(
             self,
@@ -23,7 +29,10 @@ class MultiviewDataModule(pl.LightningDataModule):
             train_size,
             dataset,
             data,
-            labels
+            labels,
+            num_workers=None,
+            pin_memory=True,
+            seed=None
         ):
 
         super().__init__()
@@ -31,51 +40,77 @@ class MultiviewDataModule(pl.LightningDataModule):
         self.batch_size = batch_size
         self.is_validate = is_validate
         self.train_size = train_size
-        self.data = data  
-        self.labels = labels 
+        self.data = self._preprocess_data(data)
+        self.labels = np.asarray(labels) if labels is not None else None
         self.dataset = dataset
         if not isinstance(self.batch_size, int):
             self.batch_size = self.data[0].shape[0]
+        if num_workers is None:
+            num_workers = default_num_workers()
+        self.num_workers = num_workers
+        self.pin_memory = pin_memory
+        self.generator = torch.Generator().manual_seed(seed) if seed is not None else None
 
     def setup(self, stage):
+        # one-shot: the input data is released once the datasets hold it
+        if self.data is None:
+            return
+        dataset = hydra.utils.instantiate(self.dataset, data=self.data, labels=self.labels, n_views=self.n_views)
         if self.is_validate:
-            train_data, test_data, train_labels, test_labels = self.train_test_split()
-            self.train_dataset = hydra.utils.instantiate(self.dataset, data=train_data, labels=train_labels, n_views=self.n_views)
-            self.test_dataset = hydra.utils.instantiate(self.dataset, data=test_data, labels=test_labels, n_views=self.n_views)
+            # split by index into the full dataset rather than copying each view
+            train_idx, test_idx = self.train_test_split(len(dataset))
+            self.train_dataset = Subset(dataset, train_idx)
+            self.test_dataset = Subset(dataset, test_idx)
         else:
-            self.train_dataset = hydra.utils.instantiate(self.dataset, data=self.data, labels=self.labels, n_views=self.n_views) 
+            self.train_dataset = dataset
             self.test_dataset = None
-        del self.data
-
-    def train_test_split(self):
-
-        N = self.data[0].shape[0]
-        train_idx = list(random.sample(range(N), int(N * self.train_size)))
-        test_idx = np.setdiff1d(list(range(N)), train_idx)
+        self.data = None
+        self.labels = None
 
-        train_data = []
-        test_data = []
-        for dt in self.data:
-            train_data.append(dt[train_idx, :])
-            test_data.append(dt[test_idx, :])
+    def train_test_split(self, N):
 
-        train_labels = None
-        test_labels = None
-        if self.labels is not None:
-            train_labels = self.labels[train_idx]
-            test_labels = self.labels[test_idx]
-
-        return train_data, test_data, train_labels, test_labels
+        perm = torch.randperm(N, generator=self.generator).tolist()
+        k = int(N * self.train_size)
+        return perm[:k], perm[k:]
 
     def train_dataloader(self):
-        return DataLoader(self.train_dataset, batch_size=self.batch_size, shuffle=False, num_workers=0) #use default num_workers for now, problem in windows! 
+        device = self.trainer.lightning_module.device if self.trainer is not None else None
+        if self._is_single_batch(self.train_dataset):
+            return SingleBatchLoader(self.train_dataset, device=device)
+        # a plain DataLoader, so Lightning can add its distributed sampler and worker seeding
+        return DataLoader(self.train_dataset, **self._dataloader_kwargs(self.train_dataset))
 
     def val_dataloader(self):
         if self.is_validate:
-            return DataLoader(
-                self.test_dataset, batch_size=self.batch_size, shuffle=False, num_workers=0)
+            if self._is_single_batch(self.test_dataset):
+                device = self.trainer.lightning_module.device if self.trainer is not None else None
+                return SingleBatchLoader(self.test_dataset, device=device)
+            return DataLoader(self.test_dataset, **self._dataloader_kwargs(self.test_dataset))
         return None
 
+    def _is_single_batch(self, dataset):
+        # the batches are not shuffled, so a batch covering the whole dataset is the same every epoch.
+        # not used on several processes, where each one only loads its shard of the data
+        return self.batch_size >= len(dataset) and _indexes_batches(dataset) and not self._is_distributed() \
+            and getattr(_unwrap_subset(dataset), "transform", None) is None
+
+    def _preprocess_data(self, data):
+        return [torch.as_tensor(d, dtype=torch.float32).contiguous() for d in data]
+
+    def _dataloader_kwargs(self, dataset):
+        return dataloader_kwargs(dataset, self.batch_size, self.num_workers, self._pin_memory(),
+                                 batched_indexing=not self._is_distributed())
+
+    def _pin_memory(self):
+        # pinning only helps copies to the GPU
+        if self.trainer is not None:
+            return self.pin_memory and self.trainer.lightning_module.device.type == "cuda"
+        return self.pin_memory and torch.cuda.is_available()
+
+    def _is_distributed(self):
+        # Lightning replaces the sampler with a per-sample DistributedSampler when training on several processes
+        return self.trainer is not None and self.trainer.world_size > 1
+
 
 class IndexDataModule(MultiviewDataModule):
     """LightningDataModule for multi-view data.
@@ -87,6 +122,9 @@ class IndexDataModule(MultiviewDataModule):
         train_size (float): Proportion of batch to use for training between 0 and 1. Remainder of batch is used for validation.
         data (list): Input data. list of identifiers to load data from.
         labels (np.array): Dataset labels. 
+        num_workers (int): Number of DataLoader worker processes. Default is None, which uses min(8, cpu count) (0 when workers are not forked, e.g. on Windows and macOS).
+        pin_memory (bool): Whether to load batches into pinned memory when training on a GPU. Default is True.
+        seed (int): Seed for the train/validation split. Default is None, which uses the global torch RNG.
     """
 
     def __init__(
@@ -98,28 +136,136 @@ class IndexDataModule(MultiviewDataModule):
             dataset,
             data,
             labels,
+            num_workers=None,
+            pin_memory=True,
+            seed=None
         ):
         data_ = data[0]
         if not isinstance(batch_size, int):
             batch_size = len(data_)
 
         super().__init__(n_views=n_views, batch_size=batch_size, is_validate=is_validate, train_size=train_size, 
-                         dataset=dataset, data=data_, labels=labels)
+                         dataset=dataset, data=data, labels=labels, num_workers=num_workers, pin_memory=pin_memory,
+                         seed=seed)
+
+    def _preprocess_data(self, data):
+        return data
+
+
+def default_num_workers():
+    """Number of DataLoader workers used when none is configured: min(8, cpu count), 0 unless workers are forked."""
+    # spawned workers (Windows, macOS) re-import the user script, keep loading in the main process there
+    # allow_none avoids fixing the start method, the platform default is the first of all start methods
+    start_method = torch.multiprocessing.get_start_method(allow_none=True) or \
+        torch.multiprocessing.get_all_start_methods()[0]
+    if start_method != "fork":
+        return 0
+    return min(8, os.cpu_count() or 1)
+
+
+def dataloader_kwargs(dataset, batch_size, num_workers, pin_memory, persistent_workers=True, batched_indexing=True):
+    """DataLoader keyword arguments shared by the datamodules and the model prediction loops. Batches are not shuffled.
+
+    Args:
+        dataset (torch.utils.data.Dataset): Dataset the DataLoader is built for. If it is an MVDataset (or a Subset of one),
+            whole batches of indices are sampled and sliced by the dataset, skipping per-sample collation.
+        batch_size (int): Batch size.
+        num_workers (int): Number of DataLoader worker processes.
+        pin_memory (bool): Whether to load batches into pinned memory.
+        persistent_workers (bool): Whether to keep the worker processes alive between epochs. Default is True.
+        batched_indexing (bool): Whether to sample whole batches of indices for MVDataset. Set to False when the sampler
+            is replaced, e.g. by Lightning's DistributedSampler. Default is True.
+
+    Returns:
+        kwargs (dict): Keyword arguments for torch.utils.data.DataLoader.
+    """
+    kwargs = {"num_workers": num_workers, "pin_memory": pin_memory}
+    if num_workers > 0:
+        kwargs.update(persistent_workers=persistent_workers, prefetch_factor=4)
+    if batched_indexing and _indexes_batches(dataset):
+        # automatic batching is disabled, the dataset gets the list of batch indices from the sampler
+        kwargs.update(batch_size=None, sampler=BatchSampler(SequentialSampler(dataset), batch_size, drop_last=False))
+    else:
+        kwargs.update(batch_size=batch_size, shuffle=False)
+    return kwargs
+
+
+def _indexes_batches(dataset):
+    # whether dataset[list_of_indices] returns a whole batch, Subset forwards lists of indices to the wrapped dataset
+    return isinstance(_unwrap_subset(dataset), MVDataset)
+
+
+def _unwrap_subset(dataset):
+    while isinstance(dataset, Subset):
+        dataset = dataset.dataset
+    return dataset
+
+
+class SingleBatchLoader:
+    """Yields the whole dataset as a single batch, built once and kept on the device across epochs.
+
+    Args:
+        dataset (torch.utils.data.Dataset): MVDataset, or Subset of one, returning whole batches for lists of indices.
+        device (torch.device): Device to keep the batch on. Default is None, which keeps it on the host.
+    """
+    def __init__(self, dataset, device=None):
+        self.dataset = dataset
+        self.device = device
+        self.batch = None
+
+    def __len__(self):
+        return 1
+
+    def __iter__(self):
+        if self.batch is None:
+            batch = self.dataset[list(range(len(self.dataset)))]
+            if self.device is not None:
+                batch = _apply_to_tensors(batch, lambda t: t.to(self.device))
+            self.batch = batch
+        yield self.batch
+
+
+class CUDAPrefetcher:
+    """Wraps a DataLoader so the next batch is copied to the GPU on a side CUDA stream while the current batch is processed.
+    Only used for the prediction loops, the training DataLoaders are handed to Lightning unwrapped.
+
+    Adapted from: https://github.com/Megvii-BaseDetection/YOLOX/blob/main/yolox/data/data_prefetcher.py
+
+    Args:
+        loader (torch.utils.data.DataLoader): DataLoader to wrap. Should use pinned memory for the copies to be asynchronous.
+        device (torch.device): CUDA device to copy batches to.
+    """
+    def __init__(self, loader, device=None):
+        self.loader = loader
+        self.device = device
+        self.stream = torch.cuda.Stream(device=device)
 
-    def train_test_split(self):
+    def __len__(self):
+        return len(self.loader)
 
-        N = len(self.data)
-        train_idx = list(random.sample(range(N), int(N * self.train_size)))
-        test_idx = list(set(list(range(N))) -  set(train_idx))
-        data = self.data
+    def __iter__(self):
+        loader = iter(self.loader)
+        batch = self.preload(loader)
+        while batch is not None:
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_stream(self.stream)
+            _apply_to_tensors(batch, lambda t: t.record_stream(current_stream))
+            next_batch = self.preload(loader)
+            yield batch
+            batch = next_batch
 
-        train_data = [data[i] for i in train_idx]
-        test_data = [data[i] for i in test_idx]
+    def preload(self, loader):
+        try:
+            batch = next(loader)
+        except StopIteration:
+            return None
+        with torch.cuda.stream(self.stream):
+            return _apply_to_tensors(batch, lambda t: t.to(self.device, non_blocking=True))
 
-        train_labels = None
-        test_labels = None
-        if self.labels is not None:
-            train_labels = self.labels[train_idx]
-            test_labels = self.labels[test_idx]
 
-        return [train_data], [test_data], train_labels, test_labels
+def _apply_to_tensors(batch, fn):
+    if isinstance(batch, torch.Tensor):
+        return fn(batch)
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(_apply_to_tensors(b, fn) for b in batch)
+    return batch
@@ -7,14 +7,15 @@ From: https://gitlab.com/acasamitjana/latentmodels_ad
 import numpy as np
 import torch
 from torch.utils.data import Dataset
+from torch.utils.data.dataloader import default_collate
 from os.path import join
 
 class MVDataset(Dataset):
     """PyTorch Dataset for storing and accessing multi-view data.
 
     Args:
-        data (list): Input data. list of torch.Tensors.
-        labels (np.array): Dataset labels. 
+        data (list): Input data. list of np.arrays or torch.Tensors, stored as contiguous float32 tensors.
+        labels (np.array, list, torch.Tensor): Dataset labels. Converted once to a torch.Tensor.
         return_index (bool): Whether to return batch index labels.
         transform (torchvision.transforms): Torchvision transformation to apply to the data. Default is None.
     """
@@ -28,7 +29,7 @@ class MVDataset(Dataset):
 
         self.N = len(self.data[0])
         self.data = [
-            torch.from_numpy(d).float() if isinstance(d, np.ndarray) else d
+            torch.as_tensor(d, dtype=torch.float32).contiguous()
             for d in self.data
         ]
         self.shape = [
@@ -36,10 +37,12 @@ class MVDataset(Dataset):
         ]
 
         if labels is not None:
-            self.labels = torch.from_numpy(self.labels)
+            self.labels = torch.as_tensor(np.asarray(self.labels))
      
 
     def __getitem__(self, index):
+        if isinstance(index, list):
+            return self._get_batch(index)
 
         x = [d[index] for d in self.data]
         if self.transform:
@@ -54,6 +57,28 @@ class MVDataset(Dataset):
             return x, self.labels[index]
         return x
 
+    def _get_batch(self, indices):
+        """Returns a whole batch by slicing each view once, in the same layout default_collate builds from __getitem__.
+        Used when the DataLoader samples lists of indices with a BatchSampler.
+
+        Args:
+            indices (list): Indices of the samples in the batch.
+        """
+        if self.transform:
+            return default_collate([self[i] for i in indices])
+
+        index = torch.as_tensor(indices)
+        x = [d[index] for d in self.data]
+
+        if self.return_index:
+            if self.labels is not None:
+                return [x, self.labels[index], index]
+            return [x, index]
+
+        if self.labels is not None:
+            return [x, self.labels[index]]
+        return x
+
     def __len__(self):
         return self.N
 
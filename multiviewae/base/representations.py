@@ -6,10 +6,22 @@ class ProductOfExperts(nn.Module):
     """Return parameters for product of independent experts.
 
     Args:
-    mu (torch.Tensor): Mean of experts distribution. M x D for M experts
-    logvar (torch.Tensor): Log of variance of experts distribution. M x D for M experts
+    mu (torch.Tensor, list): Mean of experts distribution. M x D for M experts, or list of M experts of size D
+    logvar (torch.Tensor, list): Log of variance of experts distribution. M x D for M experts, or list of M experts of size D
     """
     def forward(self, mu, logvar):
+        if isinstance(mu, (list, tuple)):
+            # accumulate precisions expert by expert instead of stacking the experts
+            sum_T = 0
+            sum_mu_T = 0
+            for mu_, logvar_ in zip(mu, logvar):
+                T = 1.0 / (torch.exp(logvar_) + EPS)
+                sum_T = sum_T + T
+                sum_mu_T = sum_mu_T + mu_ * T
+            pd_mu = sum_mu_T / sum_T
+            pd_logvar = torch.log(1.0 / sum_T)
+            return pd_mu, pd_logvar
+
         var = torch.exp(logvar) + EPS
         # precision of i-th Gaussian expert at point x
         T = 1.0 / var
@@ -30,7 +42,7 @@ class alphaProductOfExperts(nn.Module):
     def forward(self, mu, logvar, weights=None):
         if weights is None:
             num_components = mu.shape[0]
-            weights = (1/num_components) * torch.ones(mu.shape).to(mu.device)
+            weights = mu.new_tensor(1/num_components)
 
         var = torch.exp(logvar) + EPS
         T = 1. / (var + EPS)
@@ -52,7 +64,8 @@ class weightedProductOfExperts(nn.Module):
     def forward(self, mu, logvar, weight):
 
         var = torch.exp(logvar) + EPS     
-        weight = weight[:, None, :].repeat(1, mu.shape[1],1)
+        # copy the M x D weights (not the full batch) so the models can clamp them in place after the forward pass
+        weight = weight[:, None, :].clone()
         T = 1.0 / (var + EPS)
         pd_var = 1. / torch.sum(weight * T + EPS, dim=0)
         pd_mu = pd_var * torch.sum(weight * mu * T, dim=0)
@@ -97,11 +110,14 @@ class MeanRepresentation(nn.Module):
     """Return mean of separate VAE representations.
     
     Args:
-    mu (torch.Tensor): Mean of distributions. M x D for M views.
-    logvar (torch.Tensor): Log of Variance of distributions. M x D for M views.
+    mu (torch.Tensor, list): Mean of distributions. M x D for M views, or list of M views of size D.
+    logvar (torch.Tensor, list): Log of Variance of distributions. M x D for M views, or list of M views of size D.
     """
 
     def forward(self, mu, logvar, **kwargs):
+        if isinstance(mu, (list, tuple)):
+            return sum(mu) / len(mu), sum(logvar) / len(logvar)
+
         mean_mu = torch.mean(mu, axis=0)
         mean_logvar = torch.mean(logvar, axis=0)
         
@@ -70,6 +70,8 @@ config_schema = Schema({
         "learning_rate": And(float, lambda x: 0 < x < 1),
         "sparse": bool,
         "threshold": Or(And(float, lambda x: 0 < x < 1), 0),
+        Optional("use_compile"): bool,
+        Optional("use_tf32"): bool,
         Optional("eps"): And(float, lambda x: 0 < x <= 1e-10),
         Optional("beta"): And(Or(int, float), lambda x: x > 0),
         Optional("K"): And(int, lambda x: x >= 1),
@@ -83,6 +85,8 @@ config_schema = Schema({
         "batch_size": Or(And(int, lambda x: x > 0), None),
         "is_validate": bool,
         "train_size": And(float, lambda x: 0 < x < 1),
+        Optional("num_workers"): Or(And(int, lambda x: x >= 0), None),
+        Optional("pin_memory"): bool,
         "dataset": {
             "_target_" : Regex(r'(.*?)Dataset$'),
             Optional("data_dir"): str, 
@@ -173,7 +177,9 @@ config_schema = Schema({
        "accelerator": Or("cpu", "gpu", "auto"),
        "max_epochs": And(int, lambda x: x > 0),
        "deterministic": bool,
-       "log_every_n_steps": And(int, lambda x: x > 0)
+       Optional("benchmark"): bool,
+       "log_every_n_steps": And(int, lambda x: x > 0),
+       Optional("precision"): Or(16, 32, 64, "bf16")
     },
     "callbacks": {
         "model_checkpoint": {   
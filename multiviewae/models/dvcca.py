@@ -89,6 +89,18 @@ class DVCCA(BaseModelVAE):
                     torch.FloatTensor(1, self.z_dim).normal_(0, 0.01)
                 )
 
+    def _compile_networks(self, encoders=True, decoders=True):
+        r"""Compile the encoder and decoder networks, and the private encoder networks if private=True.
+
+        Args:
+            encoders (bool): Whether to compile the encoder networks, including the private encoders.
+            decoders (bool): Whether to compile the decoder networks.
+        """
+        super()._compile_networks(encoders=encoders, decoders=decoders)
+        if encoders and self.private:
+            for net in self.private_encoders:
+                net.compile(mode="reduce-overhead")
+
     def configure_optimizers(self):
         r"""Configure optimizers for encoder, private encoder, and decoder network parameters.
 
@@ -193,7 +205,7 @@ class DVCCA(BaseModelVAE):
         Returns:
             fwd_rtn (dict): dictionary containing list of decoding distributions (px_zs), shared encoding distribution (qz_x), and (for DVCCA-private) private encoding distributions (qh_xs).
         """
-        self.zero_grad()
+        self.zero_grad(set_to_none=True)
         if self.private:
             qz_x, qz_xs, qh_xs = self.encode(x)
             px_zs = self.decode(qz_xs)
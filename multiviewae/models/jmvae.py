@@ -1,6 +1,6 @@
 import torch
 import hydra
-import numpy as np
+import math
 from ..base.constants import MODEL_JMVAE
 from ..base.base_model import BaseModelVAE
 
@@ -226,5 +226,5 @@ class JMVAE(BaseModelVAE):
             start_idx += batch_size_K
             stop_idx = min(stop_idx + batch_size_K, K)
         lnpxs = torch.stack(lnpxs)
-        ll += (torch.logsumexp(lnpxs, dim=0) - np.log(K)).mean()
+        ll += (torch.logsumexp(lnpxs, dim=0) - math.log(K)).mean()
         return -ll
\ No newline at end of file
@@ -73,10 +73,11 @@ class mAAE(BaseModelAAE):
         """
         sh = z[0].shape
         z_real = self.prior.sample(sample_shape=sh)
-        d_real = self.discriminator(z_real)
+        # keep the discriminator outputs in float32 when training with mixed precision, EPS underflows in float16
+        d_real = self.discriminator(z_real).float()
         d_fake = []
         for i in range(self.n_views):
-            d = self.discriminator(z[i])
+            d = self.discriminator(z[i]).float()
             d_fake.append(d)
         return d_real, d_fake
 
@@ -118,7 +119,8 @@ class mAAE(BaseModelAAE):
         Returns:
             fwd_rtn (dict): fwd_rtn (dict): dictionary containing discriminator output from "fake" samples (d_fake) and latent dimensions (z).
         """
-        [encoder.train() for encoder in self.encoders]
+        if self.training:   # leave the encoders in eval mode during validation
+            [encoder.train() for encoder in self.encoders]
         self.discriminator.eval()
         z = self.encode(x)
         _, d_fake = self.disc(z)
@@ -3,7 +3,7 @@ import hydra
 from ..base.constants import MODEL_MEMVAE
 from ..base.base_model import BaseModelVAE
 from ..base.representations import ProductOfExperts, MeanRepresentation
-import numpy as np
+import math
 
 class me_mVAE(BaseModelVAE):
     r"""
@@ -294,5 +294,5 @@ class me_mVAE(BaseModelVAE):
             start_idx += batch_size_K
             stop_idx = min(stop_idx + batch_size_K, K)
         lnpxs = torch.stack(lnpxs)
-        ll += (torch.logsumexp(lnpxs, dim=0) - np.log(K)).mean()
+        ll += (torch.logsumexp(lnpxs, dim=0) - math.log(K)).mean()
         return -ll
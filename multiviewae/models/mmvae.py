@@ -4,9 +4,6 @@ import hydra
 
 from ..base.constants import MODEL_MMVAE
 from ..base.base_model import BaseModelVAE
-import numpy as np
-#set numpy seed
-np.random.seed(0)
 
 class mmVAE(BaseModelVAE):
     r"""
@@ -80,7 +77,7 @@ class mmVAE(BaseModelVAE):
                 )
             else:
             # Choose one of the subset modalities at random
-                mod = np.random.choice(subset)
+                mod = self._rng.choice(subset)
                 mu, logvar = self.encoders[mod](x[mod])
                 qz_x = hydra.utils.instantiate(
                     eval(f"self.cfg.encoder.enc{mod}.enc_dist"), loc=mu, logvar=logvar
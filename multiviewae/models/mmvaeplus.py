@@ -5,9 +5,6 @@ import hydra
 from ..base.constants import MODEL_MMVAEPLUS
 from ..base.base_model import BaseModelVAE
 from ..base.distributions import Default
-import numpy as np
-#set numpy seed
-np.random.seed(0)
 
 #TODO: check if private priors are used at all here??
 
@@ -127,7 +124,7 @@ class mmVAEPlus(BaseModelVAE):
                 )
             else: 
                 # Choose one of the subset modalities at random
-                mod = np.random.choice(subset)
+                mod = self._rng.choice(subset)
                 mu_u, logvar_u, mu_w, logvar_w = self.encoders[mod](x[mod])
                 #shared latent distribution
                 qu_x = hydra.utils.instantiate(
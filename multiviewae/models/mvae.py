@@ -1,9 +1,10 @@
 import torch
 import hydra
+from omegaconf import OmegaConf
 from ..base.constants import MODEL_MVAE
 from ..base.base_model import BaseModelVAE
 from ..base.representations import ProductOfExperts, MeanRepresentation
-import numpy as np
+import math
 
 class mVAE(BaseModelVAE):
     r"""
@@ -19,6 +20,7 @@ class mVAE(BaseModelVAE):
             - model.sparse (bool): Whether to enforce sparsity of the encoding distribution.
             - model.threshold (float): Dropout threshold applied to the latent dimensions. Default is 0.
             - model.weight_ll (bool): Whether to weight the log-likelihood loss by 1/n_views.
+            - model.vectorise_encoders (bool): Whether to run identical view encoders in a single vectorised call with torch.func.vmap. Encoders with buffers (e.g. batch norm) or dropout are always run one by one. Default is False.
             - encoder.default._target_ (multiviewae.architectures.mlp.VariationalEncoder): Type of encoder class to use.
             - encoder.default.enc_dist._target_ (multiae.base.distributions.Normal, multiviewae.base.distributions.MultivariateNormal): Encoding distribution.
             - decoder.default._target_ (multiviewae.architectures.mlp.VariationalDecoder): Type of decoder class to use.
@@ -52,7 +54,8 @@ class mVAE(BaseModelVAE):
             self.join_z = MeanRepresentation()
         
         if self.warmup is not None:
-            self.beta_vals = torch.linspace(0, self.beta, self.warmup)
+            # KL weight per warmup epoch
+            self.register_buffer("beta_vals", torch.linspace(0, self.beta, self.warmup), persistent=False)
 
         if self.weight_ll:
             self.ll_weighting = 1/self.n_views
@@ -78,27 +81,11 @@ class mVAE(BaseModelVAE):
         Returns:
             (list): Single element list of joint encoding distribution.
         """
-        mu = []
-        logvar = []
-        for i in range(self.n_views):
-            mu_, logvar_ = self.encoders[i](x[i])
-            mu.append(mu_)
-            logvar.append(logvar_)
-        if not self.sparse and self.use_prior:
-            #get mu and logvar from prior expert
-            mu_ = self.prior.mean
-            mu_ = mu_.expand(mu[0].shape).to(mu[0].device)           
-            logvar_ = torch.log(self.prior.variance).to(mu[0].device)     
-            logvar_ = logvar_.expand(logvar[0].shape)      
-            mu.append(mu_)
-            logvar.append(logvar_)
-        mu = torch.stack(mu)
-        logvar = torch.stack(logvar)
+        mu, logvar = self._encode_experts(x, range(self.n_views))
         mu_out, logvar_out = self.join_z(mu, logvar)
-    
-        qz_x = hydra.utils.instantiate(
-            self.cfg.encoder.default.enc_dist, loc=mu_out, logvar=logvar_out
-        )
+
+        # keep the joint distribution in float32 when training with mixed precision
+        qz_x = self._qz_cls(loc=mu_out.float(), logvar=logvar_out.float(), **self._qz_kwargs)
         return [qz_x]
 
     def encode_subset(self, x, subset):
@@ -110,29 +97,68 @@ class mVAE(BaseModelVAE):
         Returns:
             (list): Single element list of joint encoding distribution.
         """
-        mu = []
-        logvar = []
-        for i in subset:
-            mu_, logvar_ = self.encoders[i](x[i])
-            mu.append(mu_)
-            logvar.append(logvar_)
+        mu, logvar = self._encode_experts(x, subset)
+        mu_out, logvar_out = self.join_z(mu, logvar)
+
+        # keep the joint distribution in float32 when training with mixed precision
+        qz_x = self._qz_cls(loc=mu_out.float(), logvar=logvar_out.float(), **self._qz_kwargs)
+        return [qz_x]
+
+    def _encode_experts(self, x, subset):
+        r"""Encode the views in subset and add the prior expert if used.
+
+        Args:
+            x (list): list of input data of type torch.Tensor.
+            subset (list): indices of the views to encode.
+
+        Returns:
+            mu (list): Means of the experts.
+            logvar (list): Log variances of the experts.
+        """
+        if self._fuse_encoders and len(subset) > 1:
+            mu, logvar = self._batched_forward([self.encoders[i] for i in subset], [x[i] for i in subset])
+            mu = list(mu.unbind(0))
+            logvar = list(logvar.unbind(0))
+        elif len(subset) == 2:
+            # unrolled path for the common two view case
+            i, j = subset
+            mu_i, logvar_i = self.encoders[i](x[i])
+            mu_j, logvar_j = self.encoders[j](x[j])
+            mu = [mu_i, mu_j]
+            logvar = [logvar_i, logvar_j]
+        else:
+            mu = []
+            logvar = []
+            for i in subset:
+                mu_, logvar_ = self.encoders[i](x[i])
+                mu.append(mu_)
+                logvar.append(logvar_)
         if not self.sparse and self.use_prior:
-            #get mu and logvar from prior expert
-            mu_ = self.prior.mean
-            mu_ = mu_.expand(mu[0].shape).to(mu[0].device)           
-            logvar_ = torch.log(self.prior.variance).to(mu[0].device)     
-            logvar_ = logvar_.expand(logvar[0].shape)      
+            mu_, logvar_ = self._prior_expert(mu[0])
             mu.append(mu_)
             logvar.append(logvar_)
-        mu = torch.stack(mu)
-        logvar = torch.stack(logvar)
-        mu_out, logvar_out = self.join_z(mu, logvar)
-    
-        qz_x = hydra.utils.instantiate(
-            self.cfg.encoder.default.enc_dist, loc=mu_out, logvar=logvar_out
-        )
-        return [qz_x] 
-           
+        return mu, logvar
+
+    def _prior_expert(self, mu):
+        #get mu and logvar from prior expert
+        return self._prior_mu.expand(mu.shape), self._prior_logvar.expand(mu.shape)
+
+    def _setencoders(self):
+        super()._setencoders()
+        self._fuse_encoders = self.cfg.model.get("vectorise_encoders", False) and \
+            self._is_homogeneous(self.encoders, [self.cfg.encoder[f"enc{i}"] for i in range(self.n_views)])
+        # resolve the joint encoding distribution once instead of instantiating from the config every forward pass
+        enc_dist = OmegaConf.to_container(self.cfg.encoder.default.enc_dist)
+        self._qz_cls = hydra.utils.get_class(enc_dist.pop("_target_"))
+        self._qz_kwargs = enc_dist
+
+    def _setprior(self):
+        super()._setprior()
+        if hasattr(self, "prior"):
+            # cache prior expert parameters as buffers so they follow the model device
+            self.register_buffer("_prior_mu", self.prior.mean.clone(), persistent=False)
+            self.register_buffer("_prior_logvar", torch.log(self.prior.variance), persistent=False)
+
     def decode(self, qz_x):
         r"""Forward pass of joint latent dimensions through decoder networks.
 
@@ -143,10 +169,8 @@ class mVAE(BaseModelVAE):
             (list): A nested list of decoding distributions, px_zs. The outer list has a single element indicating the shared latent dimensions. 
             The inner list is a n_view element list with the position in the list indicating the decoder index.
         """  
-        px_zs = []
-        for i in range(self.n_views):
-            px_z = self.decoders[i](qz_x[0]._sample(training=self._training, return_mean=self.return_mean))
-            px_zs.append(px_z)
+        z = qz_x[0]._sample(training=self._training, return_mean=self.return_mean)
+        px_zs = [self.decoders[i](z) for i in range(self.n_views)]
         return [px_zs]
 
     def decode_subset(self, qz_x, subset):
@@ -159,10 +183,8 @@ class mVAE(BaseModelVAE):
             (list): A nested list of decoding distributions, px_zs. The outer list has a single element indicating the shared latent dimensions. 
             The inner list is a n_view element list with the position in the list indicating the decoder index.
         """  
-        px_zs = []
-        for i in subset:
-            px_z = self.decoders[i](qz_x[0]._sample(training=self._training, return_mean=self.return_mean))
-            px_zs.append(px_z)
+        z = qz_x[0]._sample(training=self._training, return_mean=self.return_mean)
+        px_zs = [self.decoders[i](z) for i in subset]
         return [px_zs]
     
     def forward(self, x):
@@ -204,10 +226,8 @@ class mVAE(BaseModelVAE):
         Returns:
             ll (torch.Tensor): Log-likelihood loss.
         """
-        ll = 0
-        for i in range(self.n_views):
-            ll += px_zs[0][i].log_likelihood(x[i]).mean(0).sum() #*self.rescale_factors[i] #first index is latent, second index is view
-        return ll*self.ll_weighting
+        lls = [px_zs[0][i].log_likelihood(x[i]).mean(0).sum() for i in range(self.n_views)] #*self.rescale_factors[i] #first index is latent, second index is view
+        return torch.stack(lls).sum()*self.ll_weighting
 
     def loss_function(self, x, fwd_rtn):
         r"""Calculate Multimodal VAE loss.
@@ -225,10 +245,11 @@ class mVAE(BaseModelVAE):
         kl = self.calc_kl(qz_x)
         ll = self.calc_ll(x, px_zs)
 
-        if self.current_epoch > self.warmup -1:
+        # after the warmup use self.beta, which a config passed to fit can update
+        if self.current_epoch >= self.warmup:
             total = self.beta*kl - ll
         else:
-            total = self.beta_vals[self.current_epoch]*kl - ll   
+            total = self.beta_vals[self.current_epoch]*kl - ll
         losses = {"loss": total, "kl": kl, "ll": ll}
         return losses
 
@@ -242,14 +263,11 @@ class mVAE(BaseModelVAE):
             nll (torch.Tensor): Negative log-likelihood.
         """
         self._training = False
-        ll = 0
         qz_x = self.encode(x)
         zs = qz_x[0].rsample(torch.Size([K]))
-        start_idx = 0
-        stop_idx = min(start_idx + batch_size_K, K)
-        lnpxs = []
-        while start_idx < stop_idx:
-            zs_ = zs[start_idx:stop_idx]
+        lws = []
+        # decoders broadcast over the leading sample dimension, so each chunk of K samples is a single forward per view
+        for zs_ in torch.split(zs, batch_size_K):
             lpx_zs = 0
             for j in range(self.n_views):
                 px_z = self.decoders[j](zs_)
@@ -257,10 +275,6 @@ class mVAE(BaseModelVAE):
 
             lpz = self.prior.log_likelihood(zs_).sum(dim=-1)
             lqz_xy = qz_x[0].log_likelihood(zs_).sum(dim=-1)
-            ln_px = torch.logsumexp(lpx_zs + lpz - lqz_xy, dim=0)
-            lnpxs.append(ln_px)
-            start_idx += batch_size_K
-            stop_idx = min(stop_idx + batch_size_K, K)
-        lnpxs = torch.stack(lnpxs)
-        ll += (torch.logsumexp(lnpxs, dim=0) - np.log(K)).mean()
-        return -ll
\ No newline at end of file
+            lws.append(lpx_zs + lpz - lqz_xy)
+        ln_px = torch.logsumexp(torch.cat(lws), dim=0) - math.log(K)
+        return -ln_px.mean()
\ No newline at end of file
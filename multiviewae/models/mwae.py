@@ -122,7 +122,8 @@ class mWAE(BaseModelAAE):
         Returns:
             fwd_rtn (dict): fwd_rtn (dict): dictionary containing discriminator output from "fake" samples (d_fake) and latent dimensions (z).
         """
-        [encoder.train() for encoder in self.encoders]
+        if self.training:   # leave the encoders in eval mode during validation
+            [encoder.train() for encoder in self.encoders]
         self.discriminator.eval()
         z = self.encode(x)
         _, d_fake = self.disc(z)
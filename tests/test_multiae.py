@@ -583,6 +583,161 @@ def test_weightings():
             outdir = model1.cfg.out_dir
             if os.path.exists(outdir):
                 shutil.rmtree(outdir)
+
+def test_predict_inplace_update():
+    """Test that predicting again after changing the input data in place uses the updated data.
+    """
+    np.random.seed(0)
+    train_1 = np.random.rand(200, 20)
+    train_2 = np.random.rand(200, 10)
+    test_1 = np.random.rand(50, 20)
+    test_2 = np.random.rand(50, 10)
+
+    model = AE(input_dim=[20, 10])
+    model.fit(train_1, train_2, max_epochs=2)
+
+    latent = model.predict_latents(test_1, test_2)
+    test_1 += 1.
+    latent_updated = model.predict_latents(test_1, test_2)
+    assert not np.allclose(latent[0], latent_updated[0])
+
+    outdir = model.cfg.out_dir
+    if os.path.exists(outdir):
+        shutil.rmtree(outdir)
+
+def test_representations():
+    """Test that ProductOfExperts and MeanRepresentation give the same result for a list of experts and
+    for the stacked experts.
+    """
+    from multiviewae.base.representations import ProductOfExperts, MeanRepresentation
+
+    torch.manual_seed(0)
+    mu = [torch.randn(50, 5) for _ in range(3)]
+    logvar = [torch.randn(50, 5) for _ in range(3)]
+    for join_z in [ProductOfExperts(), MeanRepresentation()]:
+        mu_list, logvar_list = join_z(mu, logvar)
+        mu_stack, logvar_stack = join_z(torch.stack(mu), torch.stack(logvar))
+        assert torch.allclose(mu_list, mu_stack, atol=1e-6)
+        assert torch.allclose(logvar_list, logvar_stack, atol=1e-6)
+
+def test_datamodule_split():
+    """Test that the train/validation split of MultiviewDataModule is reproducible with a seed.
+    """
+    from multiviewae.base.dataloaders import MultiviewDataModule
+
+    np.random.seed(0)
+    data = [np.random.rand(100, 20), np.random.rand(100, 10)]
+    splits = []
+    for _ in range(2):
+        datamodule = MultiviewDataModule(n_views=2, batch_size=10, is_validate=True, train_size=0.9,
+                                         dataset={"_target_": "multiviewae.base.datasets.MVDataset"},
+                                         data=data, labels=None, seed=42)
+        datamodule.setup("fit")
+        splits.append((datamodule.train_dataset.indices, datamodule.test_dataset.indices))
+    assert splits[0] == splits[1]
+    assert len(splits[0][0]) == 90 and sorted(splits[0][0] + splits[0][1]) == list(range(100))
+
+def assert_batches_equal(a, b):
+    """Assert that two (nested lists of) batches contain the same tensors.
+    """
+    if isinstance(a, (list, tuple)):
+        assert isinstance(b, (list, tuple)) and len(a) == len(b)
+        for a_, b_ in zip(a, b):
+            assert_batches_equal(a_, b_)
+    else:
+        a = a.detach().cpu().numpy() if isinstance(a, torch.Tensor) else a
+        b = b.detach().cpu().numpy() if isinstance(b, torch.Tensor) else b
+        assert a.shape == b.shape and np.allclose(a, b)
+
+def test_predict_tensors():
+    """Test that predict_latents and predict_reconstruction return the same values with to_numpy=False
+    as with the default numpy outputs.
+    """
+    np.random.seed(0)
+    train_1 = np.random.rand(200, 20)
+    train_2 = np.random.rand(200, 10)
+    test_1 = np.random.rand(50, 20)
+    test_2 = np.random.rand(50, 10)
+
+    for m in [MODEL_AE, MODEL_MVAE]:
+        class_ = getattr(importlib.import_module("multiviewae"), m)
+        model = class_(input_dim=[20, 10])
+        model.fit(train_1, train_2, max_epochs=2)
+
+        latent = model.predict_latents(test_1, test_2)
+        latent_t = model.predict_latents(test_1, test_2, to_numpy=False)
+        assert_batches_equal(latent_t, latent)
+
+        recon = model.predict_reconstruction(test_1, test_2, batch_size=20)
+        recon_t = model.predict_reconstruction(test_1, test_2, batch_size=20, to_numpy=False)
+        assert_batches_equal(recon_t, recon)
+        recon_t[0][0] += 1. # returned tensors can be modified in place
+
+        outdir = model.cfg.out_dir
+        if os.path.exists(outdir):
+            shutil.rmtree(outdir)
+
+def test_batched_dataset():
+    """Test that MVDataset returns the same batch for a list of indices as default_collate builds from single
+    samples, with and without labels and index and through a Subset, and that DataLoaders built with
+    dataloader_kwargs return the same batches as a default DataLoader.
+    """
+    from torch.utils.data import DataLoader, Subset
+    from torch.utils.data.dataloader import default_collate
+    from multiviewae.base.datasets import MVDataset
+    from multiviewae.base.dataloaders import dataloader_kwargs
+
+    np.random.seed(0)
+    data = [np.random.rand(30, 20), np.random.rand(30, 20)]
+    labels = np.random.randint(0, 3, 30)
+    idx = [3, 0, 17, 29, 8]
+
+    for kwargs in [{}, {"labels": labels}, {"return_index": True}, {"labels": labels, "return_index": True}]:
+        dataset = MVDataset(data, n_views=2, **kwargs)
+        assert_batches_equal(dataset[idx], default_collate([dataset[i] for i in idx]))
+
+        subset = Subset(dataset, [5, 2, 11, 20, 9, 1, 14])
+        assert_batches_equal(subset[[0, 1, 3]], default_collate([subset[i] for i in [0, 1, 3]]))
+
+        for d in [dataset, subset]:
+            batches = list(DataLoader(d, **dataloader_kwargs(d, 4, 0, False)))
+            default_batches = list(DataLoader(d, batch_size=4, shuffle=False))
+            assert len(batches) == len(default_batches)
+            for batch, default_batch in zip(batches, default_batches):
+                assert_batches_equal(batch, default_batch)
+
+def test_single_batch_loader():
+    """Test that SingleBatchLoader returns the same batch as a DataLoader over the whole dataset, every epoch.
+    """
+    from torch.utils.data import DataLoader, Subset
+    from multiviewae.base.datasets import MVDataset
+    from multiviewae.base.dataloaders import SingleBatchLoader
+
+    np.random.seed(0)
+    data = [np.random.rand(30, 20), np.random.rand(30, 10)]
+    labels = np.random.randint(0, 3, 30)
+    subset = Subset(MVDataset(data, n_views=2, labels=labels), [5, 2, 11, 20, 9])
+
+    loader_batch = next(iter(DataLoader(subset, batch_size=len(subset), shuffle=False)))
+    single_loader = SingleBatchLoader(subset)
+    for _ in range(2):
+        batches = list(single_loader)
+        assert len(batches) == len(single_loader) == 1
+        assert_batches_equal(batches[0], loader_batch)
+
+def test_dataset_labels():
+    """Test that MVDataset accepts labels as a list, np.array or torch.Tensor.
+    """
+    from multiviewae.base.datasets import MVDataset
+
+    np.random.seed(0)
+    data = [np.random.rand(30, 20), np.random.rand(30, 10)]
+    labels = np.random.randint(0, 3, 30)
+    for labels_ in [labels.tolist(), labels, torch.from_numpy(labels)]:
+        dataset = MVDataset(data, n_views=2, labels=labels_)
+        assert torch.equal(dataset.labels, torch.from_numpy(labels))
+        assert dataset[4][1] == labels[4]
+
 if __name__ == "__main__":
     test_models()
     test_userconfig()
@@ -594,3 +749,10 @@ if __name__ == "__main__":
     test_fitconfig()
     test_conditionalVAE()
     test_weightings()
+    test_predict_inplace_update()
+    test_representations()
+    test_datamodule_split()
+    test_predict_tensors()
+    test_batched_dataset()
+    test_single_batch_loader()
+    test_dataset_labels()